@@ -4,145 +4,86 @@
     Copyright: 2011 Florian Boesch <pyalot@gmail.com>
 '''
 
-from parse import File3Ds
+import os, sys
+from array import array
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parse import ChunkReader
 from vector import Vec3
+from cache import Cache
+from config import Config, add_options, from_options
+from mesh import Mesh, similar
+import meshlet
+import progressive
+import encoder
+from compress import Writer
 import json
 from random import random
 from math import log
 
-scale = 0.0005
+default_scale = 0.0005
     
-class Vertex:
-    def __init__(self, index, pos, uv):
-        self.index = index
-        self.pos = pos
-        self.uv = uv
-
-class Face:
-    def __init__(self, group, v1, v2, v3):
-        self.group = group
-        self.v1 = v1
-        self.v2 = v2
-        self.v3 = v3
-
-        edge1 = self.v2.pos - self.v1.pos
-        edge2 = self.v3.pos - self.v1.pos
-
-        edgeuv1 = self.v2.uv - self.v1.uv
-        edgeuv2 = self.v3.uv - self.v2.uv
-        
-        self.normal = edge1.cross(edge2).normalize()
-
-        cp = edgeuv1.y*edgeuv2.x - edgeuv1.x*edgeuv2.y
-        if cp != 0:
-            self.tangent   = ((edge1 * -edgeuv2.y + edge2 * edgeuv1.y) / cp).normalize();
-            self.bitangent = ((edge1 * -edgeuv2.x + edge2 * edgeuv1.x) / cp).normalize();
-        else:
-            self.tangent = self.normal.cross(Vec3(0.00001, 0.00001, 1.0)).normalize()
-            self.bitangent = self.normal.cross(self.tangent).normalize()
-
-    def __contains__(self, vertex):
-        pos = vertex.pos
-        return self.v1.pos == pos or self.v2.pos == pos or self.v3.pos == pos
-
 class Object:
-    def __init__(self, index, name, center, faces):
+    def __init__(self, index, name, center, mesh, config, buffers=None, digest=None):
         self.parent = None
         self.children = []
         self.index = index
         self.name = name
         self.center = center
-        self.faces = faces
-        self.groups = {}
-        for face in faces:
-            self.groups.setdefault(face.group, []).append(face)
-
-        self.calc_normals()
+        self.mesh = mesh
+        self.config = config
+        self.buffers = buffers
+        self.digest = digest
+        self.instance = None
+
+        if buffers is None:
+            config.orient(mesh)
+            config.calc_normals(mesh)
+            mesh.transform(config.scale, tuple(center))
+
+    def share(self, original):
+        # the object becomes an instance drawn with the mesh and buffers of original
+        self.instance = original
+        self.mesh = original.mesh
+        self.buffers = original.get_buffers()
 
     def add_child(self, child):
         child.parent = self
         self.children.append(child)
 
-    def share_vertex(self, faces, vertex):
-        return [face for face in faces if vertex in face]
-
-    def avg_normal(self, faces):
-        normal = Vec3()
-        for face in faces:
-            normal = normal + face.normal
-        normal = normal / float(len(faces))
-        return normal.normalize()
-
-    def avg_tangent(self, faces):
-        tangent = Vec3()
-        for face in faces:
-            tangent = tangent + face.tangent
-        #tangent = tangent / float(len(faces))
-        #return tangent.normalize()
-        return tangent
-
-    def calc_normals(self):
-        for group, faces in self.groups.items():
-            for face in faces:
-                shared = self.share_vertex(faces, face.v1)
-                normal = face.v1.normal = self.avg_normal(shared)
-                tangent = self.avg_tangent(shared)
-                face.v1.tangent = (tangent - normal * tangent.dot(normal)).normalize()
-                face.v1.bitangent = face.v1.tangent.cross(face.v1.normal)
-                #face.v1.tangent *= 1.0 if normal.cross(tangent).dot(face.bitangent) > 0.0 else -1.0
-                
-                shared = self.share_vertex(faces, face.v2)
-                normal = face.v2.normal = self.avg_normal(shared)
-                tangent = self.avg_tangent(shared)
-                face.v2.tangent = (tangent - normal * tangent.dot(normal)).normalize()
-                face.v2.bitangent = face.v2.tangent.cross(face.v2.normal)
-                #face.v2.tangent *= 1.0 if normal.cross(tangent).dot(face.bitangent) > 0.0 else -1.0
-                
-                shared = self.share_vertex(faces, face.v3)
-                normal = face.v3.normal = self.avg_normal(shared)
-                tangent = self.avg_tangent(shared)
-                face.v3.tangent = (tangent - normal * tangent.dot(normal)).normalize()
-                face.v3.bitangent = face.v3.tangent.cross(face.v3.normal)
-                #face.v3.tangent *= 1.0 if normal.cross(tangent).dot(face.bitangent) > 0.0 else -1.0
+    def nodes(self):
+        yield self
+        for child in self.children:
+            for node in child.nodes():
+                yield node
 
     def log(self, indent=0):
         print '  '*indent + self.name
         for child in self.children:
             child.log(indent+1)
 
-    def data(self, positions, texcoords, normals, tangents, bitangents, bones):
-        center = self.center*scale
-        trans = self.get_trans()
-
-        for face in self.faces:
-            positions.extend(face.v1.pos*scale-center)
-            texcoords.extend(face.v1.uv)
-            normals.extend(face.v1.normal)
-            tangents.extend(face.v1.tangent)
-            bitangents.extend(face.v1.bitangent)
-            
-            positions.extend(face.v2.pos*scale-center)
-            texcoords.extend(face.v2.uv)
-            normals.extend(face.v2.normal)
-            tangents.extend(face.v2.tangent)
-            bitangents.extend(face.v2.bitangent)
-            
-            positions.extend(face.v3.pos*scale-center)
-            texcoords.extend(face.v3.uv)
-            normals.extend(face.v3.normal)
-            tangents.extend(face.v3.tangent)
-            bitangents.extend(face.v3.bitangent)
-
-            bones.extend(trans)
-            bones.extend(trans)
-            bones.extend(trans)
+    def get_buffers(self):
+        if self.buffers is None:
+            self.buffers = self.mesh.buffers(self.config.attributes)
+        return self.buffers
+
+    def data(self, buffer):
+        if self.instance is None:
+            buffers = self.get_buffers()
+        else: #the vertices are written once by the original
+            buffers = {}
+        for key, values in buffer.items():
+            if key == 'bone_4f':
+                values.extend(self.get_trans()*(len(buffers.get('position_3f', []))/3))
+            else:
+                values.extend(buffers.get(key, []))
 
         for child in self.children:
-            child.data(positions, texcoords, normals, tangents, bitangents, bones)
+            child.data(buffer)
 
     def get_local_offset(self):
         if self.parent:
-            return (self.center - self.parent.center)*scale
+            return (self.center - self.parent.center)*self.config.scale
         else:
             return Vec3(0.0, 0.0, 0.0)
 
@@ -157,49 +98,95 @@ class Object:
         return trans
 
 class Model:
-    def __init__(self, root):
+    def __init__(self, root, config, instances=False):
         self.root = root
+        self.config = config
+        self.instances = instances
 
     @staticmethod
-    def open(filename, bones=None):
-        infile = File3Ds.open(filename)
-        objects = []
-        objs = infile.main.children.editor.children.object
-
-        if not isinstance(objs, list): #FIXME
-            objs = [objs]
+    def open(filename, bones=None, cache=None, config=None, instances=False):
+        if config is None:
+            config = Config(scale=default_scale)
 
-        for index, obj in enumerate(objs):
+        objects = []
+        originals = {}
+        def add(obj):
+            if instances:
+                candidates = originals.setdefault(obj.digest, [])
+                positions = obj.get_buffers().get('position_3f', [])
+                for candidate in candidates:
+                    if similar(candidate.get_buffers().get('position_3f', []), positions):
+                        obj.share(candidate)
+                        break
+                else:
+                    candidates.append(obj)
+            objects.append(obj)
+
+        for index, obj in enumerate(Model.objects(filename)):
             name = obj.data.name
+            if cache:
+                # unchanged objects are spliced in from their fingerprint without decoding the mesh,
+                # the entry carries the center and the mesh digest
+                key = cache.fingerprint(obj.data.fingerprint, config=config.options(), entry='digest')
+                cached = cache.get(key)
+                if cached:
+                    buffers, meta = cached
+                    add(Object(index, name, Vec3(*meta['center']), Mesh(name), config, buffers, meta['digest']))
+                    continue
+
             mesh = obj.children.mesh
             faces = mesh.children.faces
             vertices = mesh.children.vertices
             texcoords = mesh.children.texcoords
-            center = mesh.children.matrix.data.center
+            center = Vec3(*config.point(*mesh.children.matrix.data.center))
             groups = faces.children.smoothgroup.data.groups
-            facelist = []
-            for i, (i1, i2, i3, flags) in enumerate(faces.data.faces):
-                group = groups[i]
-                pos1 = vertices.data.vertices[i1]
-                pos2 = vertices.data.vertices[i2]
-                pos3 = vertices.data.vertices[i3]
-                uv1 = texcoords.data.texcoords[i1]
-                uv2 = texcoords.data.texcoords[i2]
-                uv3 = texcoords.data.texcoords[i3]
-                v1 = Vertex(i1, pos1, uv1)
-                v2 = Vertex(i2, pos2, uv2)
-                v3 = Vertex(i3, pos3, uv3)
-                facelist.append(Face(group, v1, v2, v3))
-            objects.append(Object(index, name, center, facelist))
-        
+
+            geometry = Mesh(name)
+            geometry.positions.extend(vertices.data.positions)
+            geometry.texcoords.extend(texcoords.data.coords)
+            geometry.indices.extend(faces.data.indices.tolist())
+            geometry.groups.extend(groups)
+            geometry.materials.extend([-1]*faces.data.count)
+
+            materials = faces.children.map.get('facematerial', [])
+            if not isinstance(materials, list):
+                materials = [materials]
+            for material in materials:
+                for face in material.data.faces:
+                    geometry.materials[face] = len(geometry.material_names)
+                geometry.material_names.append(material.data.name)
+
+            obj = Object(index, name, center, geometry, config, digest=geometry.digest())
+            if cache:
+                cache.put(key, obj.get_buffers(), {'center': list(center), 'digest': obj.digest}, evict=False)
+            add(obj)
+
+        if cache:
+            cache.evict()
+
         if bones:
             root = Model.walk(bones, objects)
         else:
-            root = Object(0, 'root', Vec3(), [])
+            root = Object(0, 'root', Vec3(), Mesh(), config)
             for obj in objects:
                 root.add_child(obj)
 
-        return Model(root)
+        return Model(root, config, instances)
+
+    @staticmethod
+    def objects(filename):
+        # only one object chunk is held in memory at a time, everything else is skipped by seeking
+        file = open(filename, 'rb')
+        try:
+            reader = ChunkReader(file)
+            for id, depth, offset, length in reader:
+                if id == 0x4000 and depth == 2:
+                    reader.skip()
+                    yield reader.chunk(offset, length)
+                elif id not in (0x4d4d, 0x3d3d):
+                    reader.skip()
+        finally:
+            file.close()
 
     @staticmethod
     def walk(bones, objects):
@@ -212,50 +199,112 @@ class Model:
         else:
             return objects[bones]
     
-    def save(self, filename):
-        positions = []
-        texcoords = []
-        normals = []
-        tangents = []
-        bitangents = []
-        bones = []
-        
-        self.root.data(positions, texcoords, normals, tangents, bitangents, bones)
+    @staticmethod
+    def convert(filename, outfile, bones=None, cache=None, meshlets=None, digits=None, config=None, variants=(), instances=False):
+        if config is None:
+            config = Config(scale=default_scale)
+
+        # a hit on the whole file entry does not touch the source beyond the stat of its digest,
+        # on a miss unchanged objects are still spliced in from their own entries
+        buffer = result = None
+        if cache:
+            key = cache.key(filename, config=config.options(), hierarchy=bones, meshlets=meshlets, instances=instances)
+            cached = cache.get(key)
+            if cached:
+                buffer, result = cached
+
+        if buffer is None:
+            # objects restored from the per object cache carry no mesh to build meshlets from
+            model = Model.open(filename, bones, None if meshlets else cache, config, instances)
+            buffer, parts = model.result()
+            result = {'parts': parts}
+            if meshlets:
+                result['meshlets'] = model.meshlets(*meshlets)
+            if cache:
+                cache.put(key, buffer, result)
+
+        Model.write(outfile, buffer, result, digits, variants)
+
+    @staticmethod
+    def write(filename, buffer, result, digits=None, variants=()):
+        result = dict(result, buffer=buffer)
+        out = Writer(filename, variants)
+        encoder.dump(out, result, digits)
+        out.close()
+
+    def save(self, filename, digits=None, variants=()):
+        buffer, parts = self.result()
+        Model.write(filename, buffer, {'parts': parts}, digits, variants)
+
+    def save_progressive(self, filename, variants=(), filter=None):
+        parts = []
+        instances = []
+        for node in self.root.nodes():
+            if node.instance is not None: #drawn from the chunk of the original, see the parts tree
+                instances.append((node.index, node.instance.index, list(node.center*self.config.scale)))
+                continue
+            buffers = dict(node.get_buffers())
+            if buffers.get('position_3f'):
+                if self.config.wants('bone_4f'):
+                    buffers['bone_4f'] = node.get_trans()*(len(buffers['position_3f'])/3)
+                parts.append((node.name, node.index, buffers, list(node.center*self.config.scale)))
+        progressive.write(filename, parts, self.get_parts(self.root), variants, filter, instances)
+
+    def meshlets(self, max_vertices=64, max_triangles=124):
+        result = []
+        for node, first, count in self.get_meshes():
+            if node.mesh.triangle_count:
+                if not node.mesh.face_normals: #normals were not requested
+                    node.mesh.calc_faces(False)
+                result.append({
+                    'index': node.index,
+                    'name': node.name,
+                    'meshlets': meshlet.build(node.mesh, first, max_vertices, max_triangles),
+                })
+        return result
+
+    def get_meshes(self):
+        # the vertex range of every object owning its geometry, in the order Object.data writes them
+        result = []
+        first = 0
+        for node in self.root.nodes():
+            if node.instance is None:
+                count = len(node.get_buffers().get('position_3f', []))/3
+                result.append((node, first, count))
+                first += count
+        return result
+
+    def result(self):
+        buffer = dict((key, array('i' if key in encoder.integers else 'd')) for key in self.config.attributes)
+        self.root.data(buffer)
         parts = self.get_parts(self.root)
+        return buffer, parts
+
+    def get_parts(self, node, meshes=None):
+        if self.instances and meshes is None:
+            meshes = dict((mesh, (first, count)) for mesh, first, count in self.get_meshes())
 
-        buffer = {
-            'position_3f': positions,
-            'texcoord_2f': texcoords,
-            'normal_3f': normals,
-            'tangent_3f': tangents,
-            'bitangent_3f': bitangents,
-            'bone_4f': bones,
-        }
-
-        result = {
-            'buffer': buffer,
-            'parts': parts,
-        }
-        
-        open(filename, 'wb').write(json.dumps(result))
-
-    def get_parts(self, node):
         if node.parent:
             off = node.get_local_offset()
             result = {
                 'offset': [off.x, off.y, off.z],
                 'index': node.index,
             }
+            if self.instances:
+                # instances point at the vertices of the first object with the same mesh
+                result['first'], result['count'] = meshes[node.instance or node]
+                if node.instance is not None:
+                    result['instance'] = node.instance.index
         else:
             result = {}
 
         for child in node.children:
-            result[child.name] = self.get_parts(child)
+            result[child.name] = self.get_parts(child, meshes)
         return result
 
 if __name__ == '__main__':
     from optparse import OptionParser
-    usage = '%prog [infile] --outfile=<outfile> --hierarchy=<json>'
+    usage = '%prog [infile] --outfile=<outfile> --hierarchy=<json> --cache=<dir> --meshlets=<vertices,triangles> --progressive --digits=<buffer=digits,...> --scale=<scale> --up=<y|z> --no-weld --compress=<gzip,deflate> --filter=<shuffle|delta> --attributes=<buffer,...> --instances'
     parser = OptionParser(usage)
     parser.add_option('-o', '--outfile',
         dest = 'outfile',
@@ -267,9 +316,34 @@ if __name__ == '__main__':
         type = 'string',
         help = 'the hierarchy to use',
     )
+    parser.add_option('-c', '--cache',
+        dest = 'cache',
+        type = 'string',
+        help = 'the directory used to cache converted models',
+    )
+    parser.add_option('--cache-size',
+        dest = 'cache_size',
+        type = 'int',
+        help = 'the disk budget of the cache in megabytes',
+    )
+    parser.add_option('-m', '--meshlets',
+        dest = 'meshlets',
+        type = 'string',
+        help = 'build meshlets with at most this many vertices and triangles, e.g. 64,124',
+    )
+    parser.add_option('-p', '--progressive',
+        dest = 'progressive',
+        action = 'store_true',
+        help = 'write the progressive format, the largest parts first',
+    )
+    add_options(parser, default_scale, parts=True)
     parser.set_defaults(
         outfile = None,
         hierarchy = None,
+        cache = None,
+        cache_size = 256,
+        meshlets = None,
+        progressive = False,
     )
     options, args = parser.parse_args()
     filename = args[0]
@@ -278,10 +352,30 @@ if __name__ == '__main__':
         hierarchy = json.loads(options.hierarchy)
     else:
         hierarchy = None
-        
-    model = Model.open(filename, hierarchy)
+
+    if options.meshlets:
+        meshlets = [int(limit) for limit in options.meshlets.split(',')]
+    else:
+        meshlets = None
+
+    settings = from_options(options)
+    config = Config(**settings['config'])
+    digits = settings.get('digits')
+    variants = settings.get('compress', ())
+    instances = settings.get('instances', False)
 
     if options.outfile:
-        model.save(options.outfile)
+        if options.cache:
+            cache = Cache(options.cache, options.cache_size*1024*1024)
+        else:
+            cache = None
+        if options.progressive:
+            model = Model.open(filename, hierarchy, cache, config, instances)
+            model.save_progressive(options.outfile, variants, settings.get('filter'))
+        else:
+            Model.convert(filename, options.outfile, hierarchy, cache, meshlets, digits, config, variants, instances)
+        if cache:
+            sys.stderr.write('cache: %(hits)i hits, %(misses)i misses\n' % cache.stats())
     else:
+        model = Model.open(filename, hierarchy, config=config)
         model.root.log()
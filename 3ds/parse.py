@@ -11,9 +11,11 @@
         http://faydoc.tripod.com/formats/3ds.htm
 '''
 from struct import unpack
+from hashlib import sha1
+from array import array
 from vector import Vec2, Vec3
 
-class Data:
+class Data(object):
     size = 0
     def __init__(self, parent, data):
         self.parent = parent
@@ -28,6 +30,7 @@ class Object(Data):
         zero_index = data.find('\0')
         self.name = data[:zero_index]
         self.size = zero_index+1
+        self.fingerprint = sha1(data).hexdigest()
 
     def __repr__(self):
         return '%s %s' % (self.__class__.__name__, self.name)
@@ -38,31 +41,33 @@ class Vertices(Data):
     def __init__(self, parent, data):
         self.parent = parent
         count = unpack('H', data[:2])[0]
-        data = data[2:]
-        self.vertices = []
-        for i in range(count):
-            x, y, z = unpack('fff', data[:3*4])
-            data = data[3*4:]
-            self.vertices.append(Vec3(x,z,-y))
+        values = array('d', unpack('%if' % (count*3), data[2:2+count*3*4]))
+        self.positions = array('d', values)
+        self.positions[1::3] = values[2::3]
+        self.positions[2::3] = array('d', [-y for y in values[1::3]])
         self.size = 2 + count*3*4
 
-        for i, v1 in enumerate(self.vertices):
-            for j, v2 in list(enumerate(self.vertices))[i+1:]:
-                if v1.x == v2.x and v1.y == v2.y and v1.z == v2.z:
-                    self.vertices[j] = v1
+    @property
+    def vertices(self):
+        positions = self.positions
+        return [Vec3(*positions[i:i+3]) for i in xrange(0, len(positions), 3)]
 
 class Faces(Data):
     def __init__(self, parent, data):
         self.parent = parent
-        count = unpack('H', data[:2])[0]
-        data = data[2:]
-        self.faces = []
-        for i in range(count):
-            j = i+1
-            v1, v2, v3, flags = unpack('HHHH', data[i*4*2:j*4*2])
-            self.faces.append((v1, v2, v3, flags))
+        self.count = count = unpack('H', data[:2])[0]
+        values = unpack('%iH' % (count*4), data[2:2+count*4*2])
+        self.indices = array('H')
+        for i in xrange(0, count*4, 4):
+            self.indices.extend(values[i:i+3])
+        self.flags = array('H', values[3::4])
         self.size = 2 + count*4*2
 
+    @property
+    def faces(self):
+        indices = self.indices
+        return [tuple(indices[i*3:i*3+3]) + (flags,) for i, flags in enumerate(self.flags)]
+
 class FaceMaterial:
     def __init__(self, parent, data):
         self.parent = parent
@@ -87,14 +92,15 @@ class Texcoords(Data):
     def __init__(self, parent, data):
         self.parent = parent
         count = unpack('H', data[:2])[0]
-        data = data[2:]
-        self.texcoords = []
-        for i in range(count):
-            x, y = unpack('ff', data[:8])
-            data = data[8:]
-            self.texcoords.append(Vec2(x,1.0-y))
+        self.coords = array('d', unpack('%if' % (count*2), data[2:2+count*2*4]))
+        self.coords[1::2] = array('d', [1.0-y for y in self.coords[1::2]])
         self.size = 2 + count*2*4
 
+    @property
+    def texcoords(self):
+        coords = self.coords
+        return [Vec2(*coords[i:i+2]) for i in xrange(0, len(coords), 2)]
+
 class Matrix(Data):
     def __init__(self, parent, data):
         self.parent = parent
@@ -107,11 +113,8 @@ class SmoothGroup(Data):
     def __init__(self, parent, data):
         self.size = len(data)
         self.parent = parent
-        self.groups = []
-        for i in range(len(parent.parent.data.faces)):
-            group_id = unpack('i', data[:4])[0]
-            self.groups.append(group_id)
-            data = data[4:]
+        count = parent.parent.data.count
+        self.groups = list(unpack('%ii' % count, data[:count*4]))
 
 class Keyframer(Data): pass
 class ObjectDescription(Data): pass
@@ -179,26 +182,108 @@ class Children(object):
     def __getattr__(self, name):
         return self.map[name]
 
-class Chunk:
+class Chunk(object):
     def __init__(self, parent, id, data):
         self.parent = parent
         self.id = id
         self.name = 'unknown'
         self.data = None
-        self.children = Children()
+        self.payload = None
+        self.parsed = Children()
         if id in names:
             self.data = names[id](self, data)
             #self.name = '%s' % self.data
             self.name = self.data.__class__.__name__
-            self.parse_chunks(data[self.data.size:])
+            self.payload = data[self.data.size:]
+
+    @property
+    def children(self):
+        # children are parsed on first access so that untouched subtrees are never decoded
+        if self.payload is not None:
+            payload, self.payload = self.payload, None
+            self.parse_chunks(payload)
+        return self.parsed
 
     def parse_chunks(self, data):
         while data:
             id = unpack('H', data[:2])[0]
             length = unpack('i', data[2:6])[0]
-            self.children.add(Chunk(self, id, data[6:length]))
+            self.parsed.add(Chunk(self, id, data[6:length]))
             data = data[length:]
 
+class ChunkReader(object):
+    # chunks whose children are visited, everything else is a leaf
+    containers = set([0x4d4d, 0x3d3d, 0x4000, 0x4100, 0x4120, 0xb000, 0xb002])
+
+    def __init__(self, file):
+        self.file = file
+        self.skipped = False
+
+    def __iter__(self):
+        file = self.file
+        file.seek(0, 2)
+        stack = [(0, file.tell())]
+        while stack:
+            offset, end = stack[-1]
+            if offset + 6 > end:
+                stack.pop()
+                continue
+
+            file.seek(offset)
+            header = file.read(6)
+            id = unpack('H', header[:2])[0]
+            length = unpack('i', header[2:6])[0]
+            if length < 6: #truncated or corrupt, give up on this level
+                stack.pop()
+                continue
+
+            stack[-1] = offset+length, end
+            self.skipped = False
+            yield id, len(stack)-1, offset, length
+
+            if id in self.containers and not self.skipped:
+                start = offset + 6 + self.header_size(id, offset)
+                stack.append((start, min(offset+length, end))) #a corrupt length stays inside the parent
+
+    def skip(self):
+        # the children of the last yielded chunk are not visited, they cost a seek
+        self.skipped = True
+
+    def header_size(self, id, offset):
+        if id == 0x4000:
+            return len(self.name(offset))+1
+        elif id == 0x4120:
+            return 2 + self.count(offset)*4*2
+        else:
+            return 0
+
+    def name(self, offset):
+        file = self.file
+        file.seek(offset+6)
+        name = ''
+        while True:
+            block = file.read(64)
+            zero_index = block.find('\0')
+            if zero_index >= 0:
+                return name + block[:zero_index]
+            elif not block:
+                return name
+            name += block
+
+    def count(self, offset):
+        self.file.seek(offset+6)
+        return unpack('H', self.file.read(2))[0]
+
+    def read(self, offset, length):
+        self.file.seek(offset+6)
+        return self.file.read(length-6)
+
+    def chunk(self, offset, length, parent=None):
+        file = self.file
+        file.seek(offset)
+        id = unpack('H', file.read(2))[0]
+        return Chunk(parent, id, self.read(offset, length))
+
 class File3Ds:
     @staticmethod
     def open(filename):
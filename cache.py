@@ -0,0 +1,155 @@
+'''
+    Description: An on-disk LRU cache for converted models. Entries are keyed by the
+        content hash of the source file plus the conversion options and are stored
+        as packed binary arrays. The least recently used entries are evicted once
+        the disk budget is exceeded. The content hash of each source path is kept
+        as a small entry of its own, so it is counted and evicted like the rest.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import os, json, time, marshal
+from hashlib import sha1
+from array import array
+
+class Cache(object):
+    def __init__(self, path, budget=256*1024*1024):
+        self.path = path
+        self.budget = budget
+        self.entries = os.path.join(path, 'entries')
+        # bytes used by the entries, kept up to date by store and evict and rescanned now and
+        # then to count the entries of other processes sharing the cache
+        self.total = None
+        self.scanned = 0
+        self.rescan = 60
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.entries):
+            os.makedirs(self.entries)
+
+    def digest(self, filename):
+        # the content hash is remembered per path and only recomputed when size or mtime change
+        stat = os.stat(filename)
+        stamp = stat.st_size, stat.st_mtime
+        name = os.path.join(self.entries, 'path-' + sha1(os.path.abspath(filename)).hexdigest())
+        try:
+            saved, digest = marshal.loads(open(name, 'rb').read())
+            if saved == stamp:
+                os.utime(name, None)
+                return digest
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        digest = sha1(open(filename, 'rb').read()).hexdigest()
+        self.store(name, marshal.dumps((stamp, digest)))
+        return digest
+
+    def key(self, filename, **options):
+        return self.fingerprint(self.digest(filename), **options)
+
+    def fingerprint(self, digest, **options):
+        return sha1(digest + json.dumps(options, sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        name = os.path.join(self.entries, key)
+        try:
+            data = open(name, 'rb').read()
+            os.utime(name, None)
+        except (IOError, OSError): #missing, or evicted by another process in between
+            self.misses += 1
+            return None
+
+        try:
+            result = self.decode(data)
+        except (ValueError, EOFError, TypeError): #truncated or corrupt
+            self.misses += 1
+            self.remove(name, len(data))
+            return None
+
+        self.hits += 1
+        return result
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def put(self, key, buffers, meta=None, evict=True):
+        # callers storing many entries at once pass evict=False and call evict once at the end
+        self.store(os.path.join(self.entries, key), self.encode(buffers, meta))
+        if evict:
+            self.evict()
+
+    def encode(self, buffers, meta):
+        packed = {}
+        for name, values in buffers.items():
+            if isinstance(values, array):
+                typecode = values.typecode
+            else:
+                typecode = 'i' if values and isinstance(values[0], int) else 'd'
+            packed[name] = typecode, array(typecode, values).tostring()
+        return marshal.dumps((packed, meta))
+
+    def decode(self, data):
+        packed, meta = marshal.loads(data)
+        buffers = {}
+        for name, (typecode, values) in packed.items():
+            buffers[name] = array(typecode, values)
+        return buffers, meta
+
+    def write(self, name, data):
+        tmp = '%s.%i.tmp' % (name, os.getpid())
+        open(tmp, 'wb').write(data)
+        os.rename(tmp, name)
+
+    def store(self, name, data):
+        total = self.usage()
+        try:
+            total -= os.stat(name).st_size #replaced
+        except OSError:
+            pass
+        self.write(name, data)
+        self.total = total + len(data)
+
+    def remove(self, name, size):
+        try:
+            os.remove(name)
+        except OSError:
+            return
+        if self.total is not None:
+            self.total -= size
+
+    def usage(self):
+        if self.total is None or time.time() - self.scanned > self.rescan:
+            self.total = sum(size for mtime, size, path in self.scan())
+        return self.total
+
+    def scan(self):
+        self.scanned = time.time()
+        entries = []
+        for name in os.listdir(self.entries):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.entries, name)
+            try:
+                stat = os.stat(path)
+            except OSError: #removed by a concurrent process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        # the directory is only scanned when the running total exceeds the budget
+        if self.usage() <= self.budget:
+            return
+
+        # evicting below the budget leaves room for the next puts without another scan
+        entries = sorted(self.scan())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.budget*0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total = total
@@ -0,0 +1,50 @@
+'''
+    Description: Writes the raw output and its precompressed variants (gzip, deflate) in a
+        single pass, so web servers can serve the compressed files directly.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import gzip, zlib
+
+extensions = {
+    'gzip': '.gz',
+    'deflate': '.deflate',
+}
+
+class Deflate(object):
+    # zlib wrapped deflate as used by the http deflate content encoding
+    def __init__(self, filename, level):
+        self.file = open(filename, 'wb')
+        self.compressor = zlib.compressobj(level)
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+class Writer(object):
+    def __init__(self, filename, variants=(), level=9):
+        self.raw = open(filename, 'wb')
+        self.files = [self.raw]
+        for variant in variants:
+            if variant == 'gzip':
+                self.files.append(gzip.GzipFile(filename + extensions[variant], 'wb', level, mtime=0))
+            elif variant == 'deflate':
+                self.files.append(Deflate(filename + extensions[variant], level))
+            else:
+                raise ValueError('unknown compression: %s' % variant)
+
+    def write(self, data):
+        for file in self.files:
+            file.write(data)
+
+    def flush(self):
+        # flushing the compressors would cost compression ratio, only the raw file is flushed
+        self.raw.flush()
+
+    def close(self):
+        for file in self.files:
+            file.close()
@@ -0,0 +1,134 @@
+'''
+    Description: The per call conversion configuration. It is passed through the converters
+        instead of module globals, so conversions with different settings can run
+        concurrently in one process. add_options and from_options are the command line
+        options shared by the converters and the daemon.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import encoder
+
+# the buffers a conversion can write, positions are always written
+available = ['position_3f', 'texcoord_2f', 'normal_3f', 'tangent_3f', 'bitangent_3f', 'bone_4f']
+
+def parse_attributes(text):
+    # 'position_3f,normal_3f,texcoord_2f'
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+class Config(object):
+    def __init__(self, scale=1.0, up='y', weld=True, attributes=None):
+        if up not in ('y', 'z'):
+            raise ValueError('up axis must be y or z: %s' % up)
+        if attributes is None:
+            attributes = available
+        unknown = set(attributes) - set(available)
+        if unknown:
+            raise ValueError('unknown attributes: %s' % ', '.join(sorted(unknown)))
+        self.scale = scale
+        # the parsers produce y up, z up converts back to the 3ds convention
+        self.up = up
+        # vertices at the same position share normals within a smoothing group
+        self.weld = weld
+        # work for buffers that are not requested is skipped, from the faces to the export
+        self.attributes = set(attributes) | set(['position_3f'])
+
+    def options(self):
+        return {
+            'scale': self.scale,
+            'up': self.up,
+            'weld': self.weld,
+            'attributes': sorted(self.attributes),
+        }
+
+    def wants(self, name):
+        return name in self.attributes
+
+    def orient(self, mesh):
+        if self.up == 'z':
+            mesh.z_up()
+
+    def calc_normals(self, mesh):
+        bitangents = self.wants('bitangent_3f')
+        tangents = bitangents or self.wants('tangent_3f')
+        if tangents or self.wants('normal_3f'):
+            mesh.calc_normals(self.weld, tangents, bitangents)
+
+    def point(self, x, y, z):
+        if self.up == 'z':
+            return x, -z, y
+        return x, y, z
+
+def add_options(parser, scale=1.0, parts=False):
+    # parts adds the options of formats with a parts tree, --instances and the progressive --filter
+    parser.add_option('--scale',
+        dest = 'scale',
+        type = 'float',
+        help = 'the factor positions are scaled by',
+    )
+    parser.add_option('-u', '--up',
+        dest = 'up',
+        type = 'choice',
+        choices = ['y', 'z'],
+        help = 'the up axis of the output, y or z',
+    )
+    parser.add_option('--no-weld',
+        dest = 'weld',
+        action = 'store_false',
+        help = 'do not share normals between vertices at the same position',
+    )
+    parser.add_option('-a', '--attributes',
+        dest = 'attributes',
+        type = 'string',
+        help = 'the buffers to write, e.g. position_3f,normal_3f,texcoord_2f, all when omitted',
+    )
+    parser.add_option('-d', '--digits',
+        dest = 'digits',
+        type = 'string',
+        help = 'significant digits of the json buffers, e.g. position_3f=6,normal_3f=4 or 5 for all',
+    )
+    parser.add_option('-z', '--compress',
+        dest = 'compress',
+        type = 'string',
+        help = 'also write compressed variants next to the output, gzip and/or deflate',
+    )
+    if parts:
+        parser.add_option('-f', '--filter',
+            dest = 'filter',
+            type = 'choice',
+            choices = ['shuffle', 'delta'],
+            help = 'filter the float streams of the progressive format, shuffle or delta',
+        )
+        parser.add_option('-i', '--instances',
+            dest = 'instances',
+            action = 'store_true',
+            help = 'store identical meshes once, the parts point the copies at the shared vertices',
+        )
+    parser.set_defaults(
+        scale = scale,
+        up = 'y',
+        weld = True,
+        attributes = None,
+        digits = None,
+        compress = None,
+        filter = None,
+        instances = False,
+    )
+
+def from_options(options):
+    # the parsed options in the shape of the daemon job options, a scale of None is left
+    # to the format default
+    settings = {'config': {'up': options.up, 'weld': options.weld}}
+    if options.scale is not None:
+        settings['config']['scale'] = options.scale
+    if options.attributes:
+        settings['config']['attributes'] = parse_attributes(options.attributes)
+    if options.digits:
+        settings['digits'] = encoder.parse_digits(options.digits)
+    if options.compress:
+        settings['compress'] = options.compress.split(',')
+    if options.filter:
+        settings['filter'] = options.filter
+    if options.instances:
+        settings['instances'] = True
+    return settings
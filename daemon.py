@@ -0,0 +1,239 @@
+'''
+    Description: A conversion daemon. A pool of worker processes with the 3ds and ms3d
+        converters already imported accepts jobs over a unix domain socket, one json
+        request per line, and answers each with a json line including the timing.
+        When more jobs are in flight than workers plus queue slots, new jobs are
+        answered with busy right away so callers can back off. Jobs that take longer
+        than the timeout are answered with an error, their worker and slot stay
+        taken until the conversion returns, so new jobs are answered with busy
+        rather than queued behind hung ones.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+
+    Request:  {"path": <infile>, "outfile": <outfile>, "output": "json"|"progressive",
+               "options": {"hierarchy": <json>, "meshlets": [vertices, triangles],
+                           "digits": {<buffer>: <significant digits>},
+                           "config": {"scale": <scale>, "up": "y"|"z", "weld": <bool>,
+                                      "attributes": [<buffer>, ...]},
+                           "compress": ["gzip", "deflate"], "filter": "shuffle"|"delta",
+                           "instances": <bool>}}
+    Response: {"ok": true, "time": {"queued": s, "convert": s, "total": s}, "cache": {"hits": n, "misses": n}}
+              {"ok": false, "error": <message>, "time": {"queued": s, "total": s}}
+              the queued time of a timed out job is unknown and left out, cache counts the
+              lookups of the job when the daemon runs with a cache
+'''
+
+import os, sys, json, time, socket, signal, threading, SocketServer
+from multiprocessing import Pool, TimeoutError
+import formats
+import encoder
+from cache import Cache
+from config import Config, add_options, from_options
+from compress import Writer
+
+worker = {}
+
+def warm(cache, cache_size):
+    worker['3ds'] = formats.load('3ds', 'convert')
+    worker['ms3d'] = formats.load('ms3d', 'convert')
+    if cache:
+        worker['cache'] = Cache(cache, cache_size*1024*1024)
+    else:
+        worker['cache'] = None
+
+def convert(job):
+    start = time.time()
+    cache = worker['cache']
+    if cache:
+        before = cache.stats()
+    try:
+        path = job['path']
+        outfile = job['outfile']
+        options = job.get('options', {})
+        settings = options.get('config', {})
+        variants = options.get('compress', ())
+        format = formats.sniff(path)
+        if format == '3ds':
+            Model = worker['3ds'].Model
+            config = Config(**dict({'scale': worker['3ds'].default_scale}, **settings))
+            if job.get('output') == 'progressive':
+                model = Model.open(path, options.get('hierarchy'), cache, config, options.get('instances', False))
+                model.save_progressive(outfile, variants, options.get('filter'))
+            else:
+                Model.convert(path, outfile, options.get('hierarchy'), cache, options.get('meshlets'), options.get('digits'), config, variants, options.get('instances', False))
+        elif format == 'ms3d':
+            result = worker['ms3d'].MS3DFile.convert(path, cache, Config(**settings))
+            out = Writer(outfile, variants)
+            encoder.dump(out, result, options.get('digits'))
+            out.close()
+        else:
+            raise ValueError('unknown format: %s' % path)
+        response = {'ok': True}
+    except Exception, error:
+        response = {'ok': False, 'error': '%s: %s' % (error.__class__.__name__, error)}
+    if cache:
+        after = cache.stats()
+        response['cache'] = dict((name, after[name] - before[name]) for name in after)
+    response['start'] = start
+    response['end'] = time.time()
+    return response
+
+class Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            received = time.time()
+            try:
+                job = json.loads(line)
+            except ValueError:
+                self.respond({'ok': False, 'error': 'invalid request', 'time': {'queued': 0.0, 'total': time.time() - received}})
+                continue
+            self.respond(self.server.submit(job, received))
+
+    def respond(self, response):
+        self.wfile.write(json.dumps(response) + '\n')
+        self.wfile.flush()
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, workers=4, queue=16, cache=None, cache_size=256, job_timeout=600):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        self.pool = Pool(workers, warm, (cache, cache_size))
+        self.slots = threading.Semaphore(workers + queue)
+        self.job_timeout = job_timeout
+
+    def submit(self, job, received):
+        if not self.slots.acquire(False):
+            return {'ok': False, 'error': 'busy', 'time': {'queued': 0.0, 'total': time.time() - received}}
+        # the slot is given back when the worker is done, not when the caller stops waiting, so
+        # hung jobs keep counting against the workers and the queue
+        try:
+            pending = self.pool.apply_async(convert, (job,), callback=lambda response: self.slots.release())
+        except:
+            self.slots.release()
+            raise
+
+        try:
+            response = pending.get(self.job_timeout)
+        except TimeoutError:
+            return {'ok': False, 'error': 'timeout after %ss' % self.job_timeout, 'time': {'total': time.time() - received}}
+
+        start = response.pop('start')
+        end = response.pop('end')
+        response['time'] = {
+            'queued': start - received,
+            'convert': end - start,
+            'total': time.time() - received,
+        }
+        return response
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        os.remove(self.server_address)
+
+def submit(path, job):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.sendall(json.dumps(job) + '\n')
+    response = client.makefile('rb').readline()
+    client.close()
+    return json.loads(response)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = '%prog serve --socket=<path> --workers=<n> --queue=<n> --timeout=<seconds>\n       %prog convert [infile] --outfile=<outfile> --socket=<path>'
+    parser = OptionParser(usage)
+    parser.add_option('-s', '--socket',
+        dest = 'socket',
+        type = 'string',
+        help = 'the unix domain socket to listen on or connect to',
+    )
+    parser.add_option('-w', '--workers',
+        dest = 'workers',
+        type = 'int',
+        help = 'the number of worker processes',
+    )
+    parser.add_option('-q', '--queue',
+        dest = 'queue',
+        type = 'int',
+        help = 'how many jobs may wait for a worker before new jobs are rejected as busy',
+    )
+    parser.add_option('-t', '--timeout',
+        dest = 'timeout',
+        type = 'float',
+        help = 'the seconds a job may take before it is answered with an error',
+    )
+    parser.add_option('-c', '--cache',
+        dest = 'cache',
+        type = 'string',
+        help = 'the directory used to cache converted models',
+    )
+    parser.add_option('--cache-size',
+        dest = 'cache_size',
+        type = 'int',
+        help = 'the disk budget of the cache in megabytes',
+    )
+    parser.add_option('-o', '--outfile',
+        dest = 'outfile',
+        type = 'string',
+        help = 'the output file name',
+    )
+    parser.add_option('-r', '--hierarchy',
+        dest = 'hierarchy',
+        type = 'string',
+        help = 'the hierarchy to use',
+    )
+    parser.add_option('-m', '--meshlets',
+        dest = 'meshlets',
+        type = 'string',
+        help = 'build meshlets with at most this many vertices and triangles, e.g. 64,124',
+    )
+    parser.add_option('-p', '--progressive',
+        dest = 'progressive',
+        action = 'store_true',
+        help = 'write the progressive format',
+    )
+    add_options(parser, None, parts=True)
+    parser.set_defaults(
+        socket = '/tmp/parse-3d-files.sock',
+        workers = 4,
+        queue = 16,
+        timeout = 600,
+        cache = None,
+        cache_size = 256,
+        hierarchy = None,
+        meshlets = None,
+        progressive = False,
+    )
+    options, args = parser.parse_args()
+
+    if args and args[0] == 'serve':
+        server = Server(options.socket, options.workers, options.queue, options.cache, options.cache_size, options.timeout)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif len(args) == 2 and args[0] == 'convert' and options.outfile:
+        job_options = from_options(options)
+        if options.hierarchy:
+            job_options['hierarchy'] = json.loads(options.hierarchy)
+        if options.meshlets:
+            job_options['meshlets'] = [int(limit) for limit in options.meshlets.split(',')]
+        response = submit(options.socket, {
+            'path': os.path.abspath(args[1]),
+            'outfile': os.path.abspath(options.outfile),
+            'output': 'progressive' if options.progressive else 'json',
+            'options': job_options,
+        })
+        print json.dumps(response)
+        if not response['ok']:
+            sys.exit(1)
+    else:
+        parser.print_usage()
+        sys.exit(2)
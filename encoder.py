@@ -0,0 +1,73 @@
+'''
+    Description: A json writer for the converter output. Flat lists and typed arrays of numbers
+        are formatted with a single string format operation instead of json.dumps formatting
+        every element, optionally with a limited number of significant digits per buffer
+        (e.g. 4 for normals, 6 for positions). Integer buffers such as the bone indices
+        are always written exactly. Without digits the output equals json.dumps.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import json
+from array import array
+
+inf = float('inf')
+
+def parse_digits(text):
+    # 'normal_3f=4,position_3f=6' or a single number applying to every buffer
+    digits = {}
+    for entry in text.split(','):
+        if '=' in entry:
+            name, value = entry.split('=')
+            digits[name.strip()] = int(value)
+        else:
+            digits['*'] = int(entry)
+    return digits
+
+# buffers of indices, never rounded even when they hold floats
+integers = set(['bone_4f'])
+
+def encode_numbers(values, digits=None):
+    if not len(values):
+        return '[]'
+    if isinstance(values, array) and values.typecode not in 'fd': #repr of unsigned items ends in L
+        format = '%d'
+    elif digits is None: #repr is what json.dumps writes for floats and ints
+        format = '%r'
+    else:
+        format = '%%.%ig' % digits
+    text = '[' + ', '.join([format]*len(values)) % tuple(values) + ']'
+    if 'n' in text: #nan or inf, written the way json.dumps writes them
+        text = '[' + ', '.join(
+            json.dumps(value) if value != value or value in (inf, -inf) else format % value
+            for value in values
+        ) + ']'
+    return text
+
+def is_numbers(value):
+    if isinstance(value, array):
+        return True
+    return isinstance(value, list) and value and isinstance(value[0], (int, float)) and not isinstance(value[0], bool)
+
+def is_floats(value):
+    if isinstance(value, array):
+        return value.typecode in 'fd'
+    return isinstance(value[0], float)
+
+def dump(out, value, digits=None, key=None):
+    digits = digits or {}
+    if isinstance(value, dict):
+        out.write('{')
+        for i, (name, item) in enumerate(value.items()):
+            if i:
+                out.write(', ')
+            out.write(json.dumps(name) + ': ')
+            dump(out, item, digits, name)
+        out.write('}')
+    elif is_numbers(value):
+        if key in integers or not is_floats(value):
+            out.write(encode_numbers(value))
+        else:
+            out.write(encode_numbers(value, digits.get(key, digits.get('*'))))
+    else:
+        out.write(json.dumps(value))
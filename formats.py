@@ -0,0 +1,40 @@
+'''
+    Description: Format detection and loading of the per format modules. Each format
+        lives in its own directory with its own parse/convert/vector modules, so they
+        are loaded under unique names to keep them from shadowing each other.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import os, sys, imp
+from struct import unpack
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+def sniff(filename):
+    header = open(filename, 'rb').read(10)
+    if header.startswith('MS3D000000'):
+        return 'ms3d'
+    elif len(header) >= 6 and unpack('H', header[:2])[0] == 0x4d4d:
+        return '3ds'
+    else:
+        return None
+
+def load(format, name):
+    unique = '%s_%s' % (name, format)
+    if unique in sys.modules:
+        return sys.modules[unique]
+
+    path = os.path.join(root, format)
+    local = [filename[:-3] for filename in os.listdir(path) if filename.endswith('.py')]
+    saved = dict((module, sys.modules.pop(module)) for module in local if module in sys.modules)
+    sys.path.insert(0, path)
+    try:
+        return imp.load_source(unique, os.path.join(path, name + '.py'))
+    finally:
+        # helper modules stay referenced under their unique name, python 2 clears the globals of freed modules
+        sys.path.remove(path)
+        for module in local:
+            if module in sys.modules:
+                sys.modules.setdefault('%s_%s' % (module, format), sys.modules.pop(module))
+        sys.modules.update(saved)
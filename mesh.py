@@ -0,0 +1,224 @@
+'''
+    Description: The columnar mesh shared by the 3ds and ms3d front ends. Attributes are
+        stored as flat typed arrays (struct of arrays) and normals, tangents and the
+        export to flat per corner buffers are implemented once against it.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+from array import array
+from hashlib import sha1
+
+# per vertex attributes: name, components, buffer name
+layout = [
+    ('positions',   3, 'position_3f'),
+    ('texcoords',   2, 'texcoord_2f'),
+    ('normals',     3, 'normal_3f'),
+    ('tangents',    3, 'tangent_3f'),
+    ('bitangents',  3, 'bitangent_3f'),
+    ('bones',       4, 'bone_4f'),
+]
+
+def normalize(x, y, z):
+    length = (x*x + y*y + z*z)**0.5
+    if length == 0: #degenerate triangle
+        return x, y, z
+    return x/length, y/length, z/length
+
+def cross(sx, sy, sz, ox, oy, oz):
+    return sy*oz - oy*sz, sz*ox - oz*sx, sx*oy - ox*sy
+
+class Mesh(object):
+    def __init__(self, name=''):
+        self.name = name
+
+        self.positions = array('d')
+        self.texcoords = array('d')
+        self.normals = array('d')
+        self.tangents = array('d')
+        self.bitangents = array('d')
+        self.bones = array('i')
+
+        # per triangle
+        self.indices = array('I')
+        self.groups = array('i')
+        self.materials = array('i')
+        self.face_normals = array('d')
+        self.face_tangents = array('d')
+
+        self.material_names = []
+
+    @property
+    def vertex_count(self):
+        return len(self.positions)/3
+
+    @property
+    def triangle_count(self):
+        return len(self.indices)/3
+
+    def digest(self):
+        # the content address of the mesh without its positions, the positions of copies moved
+        # in float32 differ slightly and are compared by similar instead
+        result = sha1('%i %i %i\n' % (len(self.positions), len(self.texcoords), len(self.indices)))
+        for values in self.texcoords, self.indices, self.groups, self.materials:
+            result.update(values.tostring())
+        result.update('\0'.join(self.material_names))
+        return result.hexdigest()
+
+    def split(self):
+        # vertices used by several smoothing groups are duplicated, so that every vertex has one normal
+        remap = {}
+        columns = [(name, size, getattr(self, name)) for name, size, key in layout if getattr(self, name)]
+        split = dict((name, array(values.typecode)) for name, size, values in columns)
+        indices = array('I')
+        for face, group in enumerate(self.groups):
+            for index in self.indices[face*3:face*3+3]:
+                key = index, group
+                if key not in remap:
+                    remap[key] = len(remap)
+                    for name, size, values in columns:
+                        split[name].extend(values[index*size:index*size+size])
+                indices.append(remap[key])
+
+        self.indices = indices
+        for name, values in split.items():
+            setattr(self, name, values)
+
+    def calc_faces(self, tangents=True):
+        positions = self.positions
+        texcoords = self.texcoords
+        indices = self.indices
+        self.face_normals = face_normals = array('d')
+        self.face_tangents = face_tangents = array('d')
+
+        for face in xrange(self.triangle_count):
+            i1, i2, i3 = indices[face*3:face*3+3]
+            x1, y1, z1 = positions[i1*3:i1*3+3]
+            x2, y2, z2 = positions[i2*3:i2*3+3]
+            x3, y3, z3 = positions[i3*3:i3*3+3]
+
+            ex1, ey1, ez1 = x2-x1, y2-y1, z2-z1
+            ex2, ey2, ez2 = x3-x1, y3-y1, z3-z1
+
+            normal = normalize(*cross(ex1, ey1, ez1, ex2, ey2, ez2))
+            face_normals.extend(normal)
+            if not tangents:
+                continue
+
+            s1, t1 = texcoords[i1*2:i1*2+2]
+            s2, t2 = texcoords[i2*2:i2*2+2]
+            s3, t3 = texcoords[i3*2:i3*2+2]
+            us1, ut1 = s2-s1, t2-t1
+            us2, ut2 = s3-s1, t3-t1
+
+            cp = ut1*us2 - us1*ut2
+            if cp != 0:
+                face_tangents.extend(normalize(
+                    (ex1 * -ut2 + ex2 * ut1) / cp,
+                    (ey1 * -ut2 + ey2 * ut1) / cp,
+                    (ez1 * -ut2 + ez2 * ut1) / cp,
+                ))
+            else:
+                face_tangents.extend(normalize(*cross(*normal + (0.00001, 0.00001, 1.0))))
+
+    def calc_normals(self, weld=True, tangents=True, bitangents=True):
+        # faces of a smoothing group that share a vertex (by position when welding) are averaged,
+        # normals already present (read from the file) are kept
+        self.split()
+        self.calc_faces(tangents)
+
+        calc_normals = not self.normals
+        if not (calc_normals or tangents):
+            return
+
+        positions = self.positions
+        indices = self.indices
+        face_normals = self.face_normals
+        face_tangents = self.face_tangents
+
+        if weld:
+            vertex_key = lambda group, index: (group, tuple(positions[index*3:index*3+3]))
+        else:
+            vertex_key = lambda group, index: (group, index)
+
+        shared = {}
+        for face, group in enumerate(self.groups):
+            keys = set(vertex_key(group, index) for index in indices[face*3:face*3+3])
+            for key in keys:
+                if key in shared:
+                    count, nx, ny, nz, tx, ty, tz = shared[key]
+                else:
+                    count, nx, ny, nz, tx, ty, tz = 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+                fnx, fny, fnz = face_normals[face*3:face*3+3]
+                if tangents:
+                    ftx, fty, ftz = face_tangents[face*3:face*3+3]
+                else:
+                    ftx, fty, ftz = 0.0, 0.0, 0.0
+                shared[key] = count+1, nx+fnx, ny+fny, nz+fnz, tx+ftx, ty+fty, tz+ftz
+
+        vertex_keys = [None]*self.vertex_count
+        for face, group in enumerate(self.groups):
+            for index in indices[face*3:face*3+3]:
+                vertex_keys[index] = vertex_key(group, index)
+
+        if calc_normals:
+            self.normals = array('d')
+        self.tangents = array('d')
+        self.bitangents = array('d')
+
+        for index, key in enumerate(vertex_keys):
+            if key is None: #unreferenced vertex
+                count, nx, ny, nz, tx, ty, tz = 1, 0.0, 1.0, 0.0, 1.0, 0.0, 0.0
+            else:
+                count, nx, ny, nz, tx, ty, tz = shared[key]
+
+            if calc_normals:
+                nx, ny, nz = normalize(nx/float(count), ny/float(count), nz/float(count))
+                self.normals.extend((nx, ny, nz))
+            else:
+                nx, ny, nz = self.normals[index*3:index*3+3]
+
+            if tangents:
+                dot = tx*nx + ty*ny + tz*nz
+                tx, ty, tz = normalize(tx - nx*dot, ty - ny*dot, tz - nz*dot)
+                self.tangents.extend((tx, ty, tz))
+                if bitangents:
+                    self.bitangents.extend(cross(tx, ty, tz, nx, ny, nz))
+
+    def z_up(self):
+        for values in self.positions, self.normals:
+            for i in xrange(0, len(values), 3):
+                values[i+1], values[i+2] = -values[i+2], values[i+1]
+
+    def transform(self, scale, center):
+        cx, cy, cz = center[0]*scale, center[1]*scale, center[2]*scale
+        positions = self.positions
+        for i in xrange(0, len(positions), 3):
+            positions[i] = positions[i]*scale - cx
+            positions[i+1] = positions[i+1]*scale - cy
+            positions[i+2] = positions[i+2]*scale - cz
+
+    def buffers(self, attributes=None):
+        # flat per corner buffers as written by the json export, limited to attributes if given
+        result = {}
+        for name, size, key in layout:
+            values = getattr(self, name)
+            if values and (attributes is None or key in attributes):
+                result[key] = expand(values, size, self.indices)
+        return result
+
+def expand(values, size, indices):
+    result = array(values.typecode)
+    for index in indices:
+        result.extend(values[index*size:index*size+size])
+    return result
+
+def similar(positions, other, tolerance=1e-4):
+    # equal within the tolerance relative to the size of the geometry
+    if len(positions) != len(other):
+        return False
+    limit = tolerance * max([abs(value) for value in positions] or [0.0])
+    for a, b in zip(positions, other):
+        if abs(a - b) > limit:
+            return False
+    return True
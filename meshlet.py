@@ -0,0 +1,97 @@
+'''
+    Description: Splits the indexed triangles of a Mesh into meshlets (clusters) with a limited
+        number of vertices and triangles, each with a bounding sphere and a normal cone so
+        clients can cull backfacing or offscreen clusters before drawing.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+    Helpful Links:
+        https://github.com/zeux/meshoptimizer
+'''
+
+from mesh import normalize
+
+class Meshlet(object):
+    def __init__(self):
+        self.vertices = []
+        self.local = {}
+        self.triangles = []
+        self.faces = []
+
+    def fits(self, triangle, max_vertices, max_triangles):
+        new = len(set(index for index in triangle if index not in self.local))
+        return len(self.faces) < max_triangles and len(self.vertices) + new <= max_vertices
+
+    def add(self, face, triangle):
+        for index in triangle:
+            if index not in self.local:
+                self.local[index] = len(self.vertices)
+                self.vertices.append(index)
+            self.triangles.append(self.local[index])
+        self.faces.append(face)
+
+    def bounds(self, mesh):
+        positions = mesh.positions
+        points = [positions[index*3:index*3+3] for index in self.vertices]
+        cx = sum(p[0] for p in points)/len(points)
+        cy = sum(p[1] for p in points)/len(points)
+        cz = sum(p[2] for p in points)/len(points)
+        radius = max(((p[0]-cx)**2 + (p[1]-cy)**2 + (p[2]-cz)**2)**0.5 for p in points)
+
+        face_normals = mesh.face_normals
+        normals = [face_normals[face*3:face*3+3] for face in self.faces]
+        normals = [(face, n) for face, n in zip(self.faces, normals) if n[0] or n[1] or n[2]]
+        ax, ay, az = normalize(
+            sum(n[0] for face, n in normals),
+            sum(n[1] for face, n in normals),
+            sum(n[2] for face, n in normals),
+        )
+        mindp = min([ax*n[0] + ay*n[1] + az*n[2] for face, n in normals] or [0.0])
+
+        if mindp <= 0: #normals spread over more than a hemisphere, the cone can never cull
+            apex = cx, cy, cz
+            cutoff = 1.0
+        else:
+            # the apex is moved back along the axis until it is behind every triangle plane
+            maxt = 0.0
+            for face, (nx, ny, nz) in normals:
+                px, py, pz = positions[mesh.indices[face*3]*3:mesh.indices[face*3]*3+3]
+                t = ((cx-px)*nx + (cy-py)*ny + (cz-pz)*nz) / (ax*nx + ay*ny + az*nz)
+                maxt = max(maxt, t)
+            apex = cx - ax*maxt, cy - ay*maxt, cz - az*maxt
+            cutoff = (1.0 - mindp*mindp)**0.5
+
+        return (cx, cy, cz), radius, apex, (ax, ay, az), cutoff
+
+    def data(self, mesh, corners):
+        center, radius, apex, axis, cutoff = self.bounds(mesh)
+        # a cluster is backfacing when dot(normalize(cone_apex - eye), cone_axis) >= cone_cutoff
+        return {
+            'vertices': [corners[index] for index in self.vertices],
+            'triangles': self.triangles,
+            'center': list(center),
+            'radius': radius,
+            'cone_apex': list(apex),
+            'cone_axis': list(axis),
+            'cone_cutoff': cutoff,
+        }
+
+def build(mesh, first=0, max_vertices=64, max_triangles=124):
+    # the meshlet vertices index the flat per corner export buffers, each mesh vertex
+    # is mapped to the first corner it was written to
+    corners = {}
+    for corner, index in enumerate(mesh.indices):
+        corners.setdefault(index, first + corner)
+
+    meshlets = []
+    current = Meshlet()
+    for face in xrange(mesh.triangle_count):
+        triangle = mesh.indices[face*3:face*3+3]
+        if not current.fits(triangle, max_vertices, max_triangles):
+            meshlets.append(current)
+            current = Meshlet()
+        current.add(face, triangle)
+
+    if current.faces:
+        meshlets.append(current)
+
+    return [meshlet.data(mesh, corners) for meshlet in meshlets]
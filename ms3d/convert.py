@@ -9,8 +9,16 @@
         http://content.gpwiki.org/index.php/MS3D
 '''
 
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
 from ctypes import Structure, c_char, c_int, c_char_p, c_void_p, cast, c_ushort, sizeof, c_byte, c_float, c_uint
-from vector import Vec2, Vec3
+from array import array
+from cache import Cache
+from config import Config, add_options, from_options
+from mesh import Mesh
+import encoder
+from compress import Writer
 
 class Array(object):
     def __init__(self, address, amount, type):
@@ -256,85 +264,130 @@ class MS3DFile:
         #sub_version = c_int.from_address(addr).value
         #addr += sizeof(c_int)
 
-    @staticmethod
-    def get_tangent(normal, v1, v2, uv1, uv2):
-        #taken from http://fabiensanglard.net/bumpMapping/index.php
-        div = (uv1.x * uv2.y - uv2.x * uv1.y)
-        if div != 0.0:
-            coef = 1.0/div
-            x = coef * ((v1.x * uv2.y) + (v2.x * -uv1.y))
-            y = coef * ((v1.y * uv2.y) + (v2.y * -uv1.y))
-            z = coef * ((v1.z * uv2.y) + (v2.z * -uv1.y))
-            return x, y, z
-        else:
-            return 0.0, 0.0, 1.0
-
-    def get_triangle(self, index):
-        triangle = self.triangles[index]
-
-        v1 = self.vertices[triangle.v1]
-        v1 = v1.x, v1.y, v1.z
-        n1 = triangle.n1
-        n1 = n1.x, n1.y, n1.z
-        uv1 = triangle.s1, triangle.t1
-        
-        v2 = self.vertices[triangle.v2]
-        v2 = v2.x, v2.y, v2.z
-        n2 = triangle.n2
-        n2 = n2.x, n2.y, n2.z
-        uv2 = triangle.s2, triangle.t2
-        
-        v3 = self.vertices[triangle.v3]
-        v3 = v3.x, v3.y, v3.z
-        n3 = triangle.n3
-        n3 = n3.x, n3.y, n3.z
-        uv3 = triangle.s3, triangle.t3
-
-        t1 = self.get_tangent(Vec3(*n1), Vec3(*v2)-Vec3(*v1), Vec3(*v3)-Vec3(*v1), Vec2(*uv2)-Vec2(*uv1), Vec2(*uv3)-Vec2(*uv1))
-        t2 = self.get_tangent(Vec3(*n2), Vec3(*v3)-Vec3(*v2), Vec3(*v1)-Vec3(*v2), Vec2(*uv3)-Vec2(*uv2), Vec2(*uv1)-Vec2(*uv2))
-        t3 = self.get_tangent(Vec3(*n3), Vec3(*v1)-Vec3(*v3), Vec3(*v2)-Vec3(*v3), Vec2(*uv1)-Vec2(*uv3), Vec2(*uv2)-Vec2(*uv3))
-
-        return [
-            (v1, n1, uv1, t1),
-            (v2, n2, uv2, t2),
-            (v3, n3, uv3, t3),
-        ]
+    def get_mesh(self, group, config=None):
+        if config is None:
+            config = Config()
+
+        # columns that are not requested stay empty so split skips them, tangents need normals and texcoords
+        tangents = config.wants('tangent_3f') or config.wants('bitangent_3f')
+        normals = tangents or config.wants('normal_3f')
+        texcoords = tangents or config.wants('texcoord_2f')
+        bones = config.wants('bone_4f')
 
-    def get_group(self, group):
-        positions = []
-        normals = []
-        texcoords = []
-        tangents = []
+        mesh = Mesh(group.header.name)
+        material = group.material_index.value
         for index in group.triangle_indices:
-            triangle = self.get_triangle(index)
-            for pos, normal, uv, tangent in triangle:
-                positions.extend(pos)
-                normals.extend(normal)
-                texcoords.extend(uv)
-                tangents.extend(tangent)
+            triangle = self.triangles[index]
+            for vertex, normal, s, t in (
+                (triangle.v1, triangle.n1, triangle.s1, triangle.t1),
+                (triangle.v2, triangle.n2, triangle.s2, triangle.t2),
+                (triangle.v3, triangle.n3, triangle.s3, triangle.t3),
+            ):
+                # the joint of the vertex followed by the extra joints, -1 where there is none
+                extra = self.vertex_extras[vertex]
+                vertex = self.vertices[vertex]
+                mesh.indices.append(mesh.vertex_count)
+                mesh.positions.extend((vertex.x, vertex.y, vertex.z))
+                if bones:
+                    mesh.bones.extend((vertex.bone, extra.bones[0], extra.bones[1], extra.bones[2]))
+                if normals:
+                    mesh.normals.extend((normal.x, normal.y, normal.z))
+                if texcoords:
+                    mesh.texcoords.extend((s, t))
+            mesh.groups.append(triangle.smoothing_group)
+            mesh.materials.append(material)
+
+        config.orient(mesh)
+        config.calc_normals(mesh)
+        if config.scale != 1.0:
+            mesh.transform(config.scale, (0.0, 0.0, 0.0))
+        return mesh
+
+    def get_group(self, group, config=None):
+        # buffers that are not requested in the config are empty
+        if config is None:
+            config = Config()
+        buffers = self.get_mesh(group, config).buffers(config.attributes)
+        return [buffers.get(key, array('d')) for key in ('position_3f', 'normal_3f', 'texcoord_2f', 'tangent_3f')]
 
-        return positions, normals, texcoords, tangents
+    @staticmethod
+    def convert(filename, cache=None, config=None):
+        if config is None:
+            config = Config()
+
+        if cache:
+            key = cache.key(filename, config=config.options())
+            cached = cache.get(key)
+            if cached:
+                return cached[0]
+
+        infile = MS3DFile.open(filename)
+
+        positions = array('d')
+        normals = array('d')
+        texcoords = array('d')
+        tangents = array('d')
+        for group in infile.groups:
+            position, normal, texcoord, tangent = infile.get_group(group, config)
+            positions.extend(position)
+            normals.extend(normal)
+            texcoords.extend(texcoord)
+            tangents.extend(tangent)
+
+        result = {
+            'position_3f': positions,
+            'normal_3f': normals,
+            'tangent_3f': tangents,
+            'texcoord_2f': texcoords,
+        }
+        result = dict((name, values) for name, values in result.items() if config.wants(name))
+
+        if cache:
+            cache.put(key, result)
+        return result
 
 if __name__ == '__main__':
-    import json, sys
-    filename = sys.argv[1]
-    infile = MS3DFile.open(filename)
-
-    positions = []
-    normals = []
-    texcoords = []
-    tangents = []
-    for group in infile.groups:
-        position, normal, texcoord, tangent = infile.get_group(group)
-        positions.extend(position)
-        normals.extend(normal)
-        texcoords.extend(texcoord)
-        tangents.extend(tangent)
-
-    result = {
-        'position_3f': positions,
-        'normal_3f': normals,
-        'tangent_3f': tangents,
-        'texcoord_2f': texcoords,
-    }
-    print json.dumps(result)
+    from optparse import OptionParser
+    usage = '%prog [infile] --outfile=<outfile> --compress=<gzip,deflate> --cache=<dir> --digits=<buffer=digits,...> --scale=<scale> --up=<y|z> --no-weld --attributes=<buffer,...>'
+    parser = OptionParser(usage)
+    parser.add_option('-c', '--cache',
+        dest = 'cache',
+        type = 'string',
+        help = 'the directory used to cache converted models',
+    )
+    parser.add_option('--cache-size',
+        dest = 'cache_size',
+        type = 'int',
+        help = 'the disk budget of the cache in megabytes',
+    )
+    parser.add_option('-o', '--outfile',
+        dest = 'outfile',
+        type = 'string',
+        help = 'the output file name, the json is printed when omitted',
+    )
+    add_options(parser)
+    parser.set_defaults(
+        outfile = None,
+        cache = None,
+        cache_size = 256,
+    )
+    options, args = parser.parse_args()
+    filename = args[0]
+
+    if options.cache:
+        cache = Cache(options.cache, options.cache_size*1024*1024)
+    else:
+        cache = None
+
+    settings = from_options(options)
+    digits = settings.get('digits')
+    result = MS3DFile.convert(filename, cache, Config(**settings['config']))
+    if options.outfile:
+        out = Writer(options.outfile, settings.get('compress', ()))
+        encoder.dump(out, result, digits)
+        out.close()
+    else:
+        encoder.dump(sys.stdout, result, digits)
+        print
+    if cache:
+        sys.stderr.write('cache: %(hits)i hits, %(misses)i misses\n' % cache.stats())
@@ -0,0 +1,78 @@
+'''
+    Description: Reports vertex, triangle and object counts of 3ds and ms3d files by reading
+        only chunk/section headers and the counts in front of each section, no payload
+        is decoded. Meant for admission control and sizing before a full conversion.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+from struct import unpack, calcsize
+import formats
+
+# packed sizes of the ms3d Vertex and Triangle structures and the group header
+ms3d_vertex = calcsize('<bfffbb')
+ms3d_triangle = calcsize('<HHHH9f6fbb')
+ms3d_group = calcsize('<b32sH')
+
+def probe(filename, largest=5):
+    format = formats.sniff(filename)
+    file = open(filename, 'rb')
+    try:
+        if format == '3ds':
+            vertices, meshes = probe_3ds(file)
+        elif format == 'ms3d':
+            vertices, meshes = probe_ms3d(file)
+        else:
+            raise ValueError('unknown format: %s' % filename)
+    finally:
+        file.close()
+
+    return {
+        'format': format,
+        'objects': len(meshes),
+        'vertices': vertices,
+        'triangles': sum(mesh['triangles'] for mesh in meshes),
+        'names': [mesh['name'] for mesh in meshes],
+        'largest': sorted(meshes, key=lambda mesh: mesh['triangles'], reverse=True)[:largest],
+    }
+
+def probe_3ds(file):
+    reader = formats.load('3ds', 'parse').ChunkReader(file)
+    meshes = []
+    for id, depth, offset, length in reader:
+        if id == 0x4000 and depth == 2:
+            meshes.append({'name': reader.name(offset), 'vertices': 0, 'triangles': 0})
+        elif id == 0x4110 and meshes:
+            meshes[-1]['vertices'] = reader.count(offset)
+        elif id == 0x4120 and meshes:
+            meshes[-1]['triangles'] = reader.count(offset)
+            reader.skip()
+        elif id not in (0x4d4d, 0x3d3d, 0x4100):
+            reader.skip()
+    return sum(mesh['vertices'] for mesh in meshes), meshes
+
+def probe_ms3d(file):
+    file.seek(14)
+    vertices = unpack('H', file.read(2))[0]
+    addr = 16 + vertices*ms3d_vertex
+    file.seek(addr)
+    triangles = unpack('H', file.read(2))[0]
+    addr += 2 + triangles*ms3d_triangle
+    file.seek(addr)
+    group_count = unpack('H', file.read(2))[0]
+    addr += 2
+
+    # groups index into the shared vertex list, so only the file wide vertex count is known
+    meshes = []
+    for i in range(group_count):
+        file.seek(addr)
+        flags, name, num_triangles = unpack('<b32sH', file.read(ms3d_group))
+        meshes.append({'name': name.split('\0')[0], 'vertices': None, 'triangles': num_triangles})
+        addr += ms3d_group + num_triangles*2 + 1
+
+    return vertices, meshes
+
+if __name__ == '__main__':
+    import sys, json
+    for filename in sys.argv[1:]:
+        print json.dumps(probe(filename))
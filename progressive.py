@@ -0,0 +1,159 @@
+'''
+    Description: A progressive output format. A small json header with the parts tree and
+        the bounds of every part is written first, followed by one geometry chunk per part,
+        largest part first. Every chunk carries its own json header and float32 arrays, so
+        a client can decode and draw each chunk as soon as its bytes arrived.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+
+    Layout (little endian):
+        file    := 'P3DS' header chunk*
+        header  := uint32 length, json {parts, bounds, part_bounds, chunks}
+        chunk   := uint32 length, json {name, index, vertices, attributes, filter}, uint32 length, data
+        the chunk attributes map each buffer name to [byte offset, byte length] in data,
+        part_bounds and chunks refer to the parts by object index as names may repeat,
+        instances have part_bounds (those of their original) but no chunk
+
+    Filters (per attribute, to improve the compression ratio):
+        shuffle stores the first bytes of all floats, then all second bytes and so on
+        delta   replaces each float's bits by the difference (mod 2**32) to the same
+                component of the previous vertex, then shuffles
+'''
+
+import sys, json
+from array import array
+from struct import pack
+from compress import Writer
+
+magic = 'P3DS'
+
+def bounds(positions):
+    if not positions:
+        return None
+    xs, ys, zs = positions[0::3], positions[1::3], positions[2::3]
+    lower = [min(xs), min(ys), min(zs)]
+    upper = [max(xs), max(ys), max(zs)]
+    center = [(l+u)/2.0 for l, u in zip(lower, upper)]
+    radius = sum((u-c)**2 for u, c in zip(upper, center))**0.5
+    return {'min': lower, 'max': upper, 'center': center, 'radius': radius}
+
+def components(key):
+    # position_3f -> 3
+    return int(key.rsplit('_', 1)[1][:-1])
+
+def little(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+def native(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def encode(values, size, filter):
+    if filter == 'delta':
+        bits = array('I', values.tostring())
+        for i in xrange(len(bits)-1, size-1, -1):
+            bits[i] = (bits[i] - bits[i-size]) & 0xffffffff
+        values = bits
+    data = little(values)
+    if filter in ('shuffle', 'delta'):
+        data = ''.join(data[i::4] for i in range(4))
+    return data
+
+def decode(data, size, filter):
+    if filter in ('shuffle', 'delta'):
+        count = len(data)/4
+        planes = bytearray(len(data))
+        for i in range(4):
+            planes[i::4] = data[i*count:(i+1)*count]
+        data = str(planes)
+    if filter == 'delta':
+        bits = native('I', data)
+        for i in xrange(size, len(bits)):
+            bits[i] = (bits[i] + bits[i-size]) & 0xffffffff
+        return array('f', bits.tostring())
+    return native('f', data)
+
+def record(out, data):
+    out.write(pack('<I', len(data)))
+    out.write(data)
+
+def write(filename, parts, tree, variants=(), filter=None, instances=()):
+    # parts is a list of (name, index, buffers, offset) with positions relative to offset, the
+    # biggest part is sent first as the bounding radius is the best screen space estimate
+    # available without a camera, instances is a list of (index, original index, offset) that
+    # have no chunk of their own but are placed with the bounds of the original
+    parts = [(name, index, buffers, offset, bounds(buffers.get('position_3f'))) for name, index, buffers, offset in parts]
+    parts = [part for part in parts if part[4]]
+    parts.sort(key=lambda part: part[4]['radius'], reverse=True)
+
+    placed = [(index, offset, part_bounds) for name, index, buffers, offset, part_bounds in parts]
+    shared = dict((index, part_bounds) for index, offset, part_bounds in placed)
+    placed.extend((index, offset, shared[original]) for index, original, offset in instances if original in shared)
+
+    corners = []
+    for index, offset, part_bounds in placed:
+        for corner in part_bounds['min'], part_bounds['max']:
+            corners.extend(c+o for c, o in zip(corner, offset))
+    everything = bounds(corners)
+
+    if filter not in (None, 'shuffle', 'delta'):
+        raise ValueError('unknown filter: %s' % filter)
+
+    out = Writer(filename, variants)
+    out.write(magic)
+    record(out, json.dumps({
+        'parts': tree,
+        'bounds': everything,
+        'part_bounds': dict((index, part_bounds) for index, offset, part_bounds in placed),
+        'chunks': [index for name, index, buffers, offset, part_bounds in parts],
+    }))
+    out.flush()
+
+    for name, index, buffers, offset, part_bounds in parts:
+        data = []
+        offset = 0
+        attributes = {}
+        for key, values in sorted(buffers.items()):
+            data.append(encode(array('f', values), components(key), filter))
+            attributes[key] = [offset, len(data[-1])]
+            offset += len(data[-1])
+
+        record(out, json.dumps({
+            'name': name,
+            'index': index,
+            'vertices': len(buffers['position_3f'])/3,
+            'attributes': attributes,
+            'filter': filter,
+        }))
+        record(out, ''.join(data))
+        out.flush()
+
+    out.close()
+
+def read(filename):
+    # yields the header followed by each decoded chunk, mainly useful for testing
+    from struct import unpack
+    data = open(filename, 'rb').read()
+    assert data[:4] == magic
+    addr = 4
+
+    def next_record(addr):
+        length = unpack('<I', data[addr:addr+4])[0]
+        return data[addr+4:addr+4+length], addr+4+length
+
+    header, addr = next_record(addr)
+    yield json.loads(header)
+    while addr < len(data):
+        header, addr = next_record(addr)
+        payload, addr = next_record(addr)
+        header = json.loads(header)
+        header['buffers'] = dict(
+            (key, decode(payload[offset:offset+length], components(key), header['filter']).tolist())
+            for key, (offset, length) in header['attributes'].items()
+        )
+        yield header
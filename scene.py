@@ -0,0 +1,184 @@
+'''
+    Description: Merges many 3ds and ms3d models into a single set of float buffers. The
+        buffers are written attribute after attribute into one binary file, each aligned
+        so the whole file can be uploaded at once, and a json manifest maps every model
+        and part to its vertex and byte ranges. Parts are listed with their name and index,
+        as names may repeat. With instances, parts with the same mesh and positions, in one
+        model or across models, share a single copy of their vertices, and only the parts
+        have ranges.
+    License: AGPLv3, see LICENSE for more details
+    Copyright: 2011 Florian Boesch <pyalot@gmail.com>
+'''
+
+import os, json
+from array import array
+import formats
+from mesh import similar
+
+attributes = [
+    ('position_3f',     3),
+    ('texcoord_2f',     2),
+    ('normal_3f',       3),
+    ('tangent_3f',      3),
+    ('bitangent_3f',    3),
+    ('bone_4f',         4),
+]
+
+def load(filename, instances=False):
+    format = formats.sniff(filename)
+    if format == '3ds':
+        return load_3ds(filename, instances)
+    elif format == 'ms3d':
+        return load_ms3d(filename)
+    else:
+        raise ValueError('unknown format: %s' % filename)
+
+def load_3ds(filename, instances=False):
+    convert = formats.load('3ds', 'convert')
+    model = convert.Model.open(filename, instances=instances)
+    buffer, tree = model.result()
+    meshes = dict((node, (first, count)) for node, first, count in model.get_meshes())
+
+    parts = []
+    stack = [(model.root, '')]
+    while stack:
+        node, path = stack.pop()
+        if node.parent:
+            first, count = meshes[node.instance or node]
+            off = node.get_local_offset()
+            parts.append((path, first, count, {'offset': [off.x, off.y, off.z], 'index': node.index}, node.digest))
+        for child in reversed(node.children):
+            stack.append((child, path + '/' + child.name if path else child.name))
+
+    return buffer, parts
+
+def load_ms3d(filename):
+    convert = formats.load('ms3d', 'convert')
+    infile = convert.MS3DFile.open(filename)
+    buffer = {}
+    parts = []
+    first = 0
+    for index, group in enumerate(infile.groups):
+        mesh = infile.get_mesh(group)
+        buffers = mesh.buffers()
+        count = len(buffers['position_3f'])/3
+        parts.append((group.header.name, first, count, {'index': index}, mesh.digest()))
+        first += count
+        for name, values in buffers.items():
+            buffer.setdefault(name, array(values.typecode)).extend(values)
+    return buffer, parts
+
+def ranges(layout, first, count):
+    return dict(
+        (name, [entry['offset'] + first*entry['size']*4, count*entry['size']*4])
+        for name, entry in layout.items()
+    )
+
+def save(filenames, outfile, align=16, instances=False):
+    # segments are the (buffer, first, count) vertex ranges written to the buffer file in order
+    models = []
+    segments = []
+    stored = {}
+    first = 0
+    for filename in filenames:
+        buffer, parts = load(filename, instances)
+        if not instances:
+            count = len(buffer['position_3f'])/3
+            segments.append((buffer, 0, count))
+            parts = [(name, first + part_first, part_count, extra) for name, part_first, part_count, extra, digest in parts]
+            models.append((filename, first, count, parts))
+            first += count
+            continue
+
+        placed = []
+        for name, part_first, part_count, extra, digest in parts:
+            positions = buffer['position_3f'][part_first*3:(part_first+part_count)*3]
+            for other, shared_first in stored.get(digest, []):
+                if similar(other, positions):
+                    break
+            else:
+                shared_first = first
+                stored.setdefault(digest, []).append((positions, first))
+                segments.append((buffer, part_first, part_count))
+                first += part_count
+            placed.append((name, shared_first, part_count, extra))
+        # the parts of a model may live anywhere in the buffer, so it has no range of its own
+        models.append((filename, None, None, placed))
+
+    binfile = os.path.splitext(outfile)[0] + '.bin'
+    out = open(binfile, 'wb')
+    layout = {}
+    offset = 0
+    for name, size in attributes:
+        values = array('f')
+        for buffer, first, count in segments:
+            if name in buffer:
+                values.extend(array('f', buffer[name][first*size:(first+count)*size]))
+            else: #attribute not produced by this format
+                values.extend(array('f', [0.0])*(count*size))
+
+        padding = -offset % align
+        out.write('\0'*padding)
+        offset += padding
+        values.tofile(out)
+        layout[name] = {'offset': offset, 'length': len(values)*4, 'size': size}
+        offset += len(values)*4
+    out.close()
+
+    manifest = {
+        'buffer': os.path.basename(binfile),
+        'align': align,
+        'vertices': sum(count for buffer, first, count in segments),
+        'attributes': layout,
+        'models': [],
+    }
+    for filename, first, count, parts in models:
+        entries = []
+        for name, part_first, part_count, extra in parts:
+            entry = {
+                'name': name,
+                'first': part_first,
+                'count': part_count,
+                'bytes': ranges(layout, part_first, part_count),
+            }
+            entry.update(extra)
+            entries.append(entry)
+
+        model = {
+            'name': os.path.basename(filename),
+            'parts': entries,
+        }
+        if first is not None:
+            model['first'] = first
+            model['count'] = count
+            model['bytes'] = ranges(layout, first, count)
+        manifest['models'].append(model)
+
+    open(outfile, 'wb').write(json.dumps(manifest))
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    usage = '%prog [infiles] --outfile=<manifest> --align=<bytes> --instances'
+    parser = OptionParser(usage)
+    parser.add_option('-o', '--outfile',
+        dest = 'outfile',
+        type = 'string',
+        help = 'the manifest file name, the buffers are written next to it with a .bin extension'
+    )
+    parser.add_option('-a', '--align',
+        dest = 'align',
+        type = 'int',
+        help = 'the byte alignment of each attribute in the buffer file',
+    )
+    parser.add_option('-i', '--instances',
+        dest = 'instances',
+        action = 'store_true',
+        help = 'store parts with identical meshes once, also across the models',
+    )
+    parser.set_defaults(
+        instances = False,
+        outfile = 'scene.json',
+        align = 16,
+    )
+    options, args = parser.parse_args()
+    save(args, options.outfile, options.align, options.instances)